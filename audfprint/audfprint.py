@@ -10,26 +10,42 @@ Port of the Matlab implementation.
 """
 from __future__ import division, print_function
 
+# For flushing the buffered report file at interpreter exit
+import atexit
+# For per-thread analyzer copies in the threaded add path
+import copy
+# For worker binding in multiprocessing pools
+import functools
+# For the buffered report-file writer
+import io
 # For multiprocessing options
 import multiprocessing
 import os
 # For __main__
 import sys
+# For the hash-table lock in the threaded add path
+import threading
 # For reporting progress time
 import time
+# For the precompute/match worker pools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+# For zero-copy return of hash tables from worker processes
+from multiprocessing import resource_tracker, shared_memory
 
 # For command line interface
 import docopt
-import joblib
+import numpy as np
 
 # My hash_table implementation
 # Access to match functions, used in command line interface
 # The actual analyzer class/code
-from . import audfprint_analyze, audfprint_match, hash_table
+from . import audfprint_analyze, audfprint_match, hash_table, stft
 
 if sys.version_info[0] >= 3:
-    # Python 3 specific definitions
-    time_clock = time.process_time
+    # Python 3 specific definitions.  time.clock() went away in 3.8, and
+    # its process_time stand-in undercounts multi-process runs; elapsed
+    # wall time is what the x-realtime report wants.
+    time_clock = time.perf_counter
 else:
     # Python 2 specific definitions
     time_clock = time.clock
@@ -38,27 +54,40 @@ else:
 def filename_list_iterator(filelist, wavdir, wavext, listflag):
     """Iterator to yeild all the filenames, possibly interpreting them
     as list files, prepending wavdir"""
+    # This iterator drives the whole pipeline and can see millions of
+    # names in --list mode, so build the prefix once instead of paying
+    # os.path.join's intermediate allocations per name.  Absolute names
+    # still ignore wavdir, as os.path.join did.
+    if wavdir and not wavdir.endswith(os.sep):
+        prefix = wavdir + os.sep
+    else:
+        prefix = wavdir
     if not listflag:
         for filename in filelist:
-            yield os.path.join(wavdir, filename + wavext)
+            name = filename + wavext
+            yield name if name.startswith(os.sep) else prefix + name
     else:
         for listfilename in filelist:
-            with open(listfilename, "r") as f:
+            # List files can run to millions of lines; read in 1 MB gulps.
+            with open(listfilename, "r", buffering=1 << 20) as f:
                 for filename in f:
-                    yield os.path.join(wavdir, filename.rstrip("\n") + wavext)
+                    name = filename.rstrip("\n") + wavext
+                    yield name if name.startswith(os.sep) else prefix + name
 
 
 # for saving precomputed fprints
+# Directories already created (or found) by ensure_dir, so a big
+# precompute batch stats each output directory only once.
+_CREATED_DIRS = set()
+
+
 def ensure_dir(dirname):
     """ensure that the named directory exists"""
-    if len(dirname):
-        if not os.path.exists(dirname):
-            # There's a race condition for multiprocessor; don't worry if the
-            # directory gets created before we get to it.
-            try:
-                os.makedirs(dirname)
-            except:
-                pass
+    if len(dirname) and dirname not in _CREATED_DIRS:
+        # exist_ok also covers the multiprocessor race where another
+        # worker creates the directory before we get to it.
+        os.makedirs(dirname, exist_ok=True)
+        _CREATED_DIRS.add(dirname)
 
 
 # Command line interface
@@ -66,17 +95,12 @@ def ensure_dir(dirname):
 # basic operations, each in a separate function
 
 
-def file_precompute_peaks_or_hashes(
-    analyzer,
-    filename,
-    precompdir,
-    precompext=None,
-    hashes_not_peaks=True,
-    skip_existing=False,
-    strip_prefix=None,
-):
-    """Perform precompute action for one file, return list
-    of message strings"""
+@functools.lru_cache(maxsize=4096)
+def precompute_filename(filename, precompdir, precompext, strip_prefix=None):
+    """Return the name under precompdir where the precomputed
+    fingerprint for filename is (or would be) stored.  Cached, since
+    the new/add path and the precompute writer both ask for the same
+    mapping for each file in a batch."""
     # If strip_prefix is specified and matches the start of filename,
     # remove it from filename.
     if strip_prefix and filename[: len(strip_prefix)] == strip_prefix:
@@ -94,12 +118,28 @@ def file_precompute_peaks_or_hashes(
         ]
     )
     root = os.path.splitext(relname)[0]
+    return os.path.join(precompdir, root + precompext)
+
+
+def file_precompute_peaks_or_hashes(
+    analyzer,
+    filename,
+    precompdir,
+    precompext=None,
+    hashes_not_peaks=True,
+    skip_existing=False,
+    strip_prefix=None,
+):
+    """Perform precompute action for one file, return list
+    of message strings"""
     if precompext is None:
         if hashes_not_peaks:
             precompext = audfprint_analyze.PRECOMPEXT
         else:
             precompext = audfprint_analyze.PRECOMPPKEXT
-    opfname = os.path.join(precompdir, root + precompext)
+    opfname = precompute_filename(
+        filename, precompdir, precompext, strip_prefix=strip_prefix
+    )
     if skip_existing and os.path.isfile(opfname):
         return ["file " + opfname + " exists (and --skip-existing); skipping"]
     else:
@@ -148,7 +188,7 @@ def file_precompute(
 def make_ht_from_list(analyzer, filelist, hashbits, depth, maxtime, pipe=None):
     """Populate a hash table from a list, used as target for
     multiprocess division.  pipe is a pipe over which to push back
-    the result, else return it"""
+    the result (as shared-memory blocks), else return it"""
     # Create new ht instance
     ht = hash_table.HashTable(hashbits=hashbits, depth=depth, maxtime=maxtime)
     # Add in the files
@@ -157,11 +197,158 @@ def make_ht_from_list(analyzer, filelist, hashbits, depth, maxtime, pipe=None):
         ht.store(filename, hashes)
     # Pass back to caller
     if pipe:
-        pipe.send(ht)
+        # Expose the two big arrays through shared memory so the parent
+        # can merge them in place, instead of pickling the whole table
+        # through the pipe.
+        table_shm = shared_memory.SharedMemory(create=True, size=ht.table.nbytes)
+        counts_shm = shared_memory.SharedMemory(create=True, size=ht.counts.nbytes)
+        np.ndarray(ht.table.shape, ht.table.dtype, buffer=table_shm.buf)[:] = ht.table
+        np.ndarray(ht.counts.shape, ht.counts.dtype, buffer=counts_shm.buf)[:] = (
+            ht.counts
+        )
+        # The parent takes over ownership and unlinks the blocks once it
+        # has merged them; stop our resource tracker from unlinking them
+        # when this worker exits (no track=False before Python 3.13).
+        resource_tracker.unregister(table_shm._name, "shared_memory")
+        resource_tracker.unregister(counts_shm._name, "shared_memory")
+        pipe.send(
+            (
+                table_shm.name,
+                ht.table.shape,
+                ht.table.dtype.str,
+                counts_shm.name,
+                ht.counts.shape,
+                ht.counts.dtype.str,
+                ht.names,
+                ht.hashesperid,
+                ht.params,
+            )
+        )
+        table_shm.close()
+        counts_shm.close()
     else:
         return ht
 
 
+def _cmd_merge(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix,
+):
+    """merge/newmerge: files are other hash tables, merge them in"""
+    for filename in filename_iter:
+        hash_tab2 = hash_table.HashTable(filename)
+        if "samplerate" in hash_tab.params:
+            assert hash_tab.params["samplerate"] == hash_tab2.params["samplerate"]
+        else:
+            # "newmerge" fails to setup the samplerate param
+            hash_tab.params["samplerate"] = hash_tab2.params["samplerate"]
+        hash_tab.merge(hash_tab2)
+
+
+def _cmd_precompute(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix,
+):
+    """just precompute fingerprints, single core"""
+    for filename in filename_iter:
+        report(
+            file_precompute(
+                analyzer,
+                filename,
+                outdir,
+                type,
+                skip_existing=skip_existing,
+                strip_prefix=strip_prefix,
+            )
+        )
+
+
+def _cmd_match(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix,
+):
+    """Running query, single-core mode"""
+    for num, filename in enumerate(filename_iter):
+        msgs = matcher.file_match_to_msgs(analyzer, hash_tab, filename, num)
+        report(msgs)
+
+
+def _cmd_new_add(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix,
+):
+    """new/add: Adding files"""
+    tothashes = 0
+    ix = 0
+    for filename in filename_iter:
+        report([time.ctime() + " ingesting #" + str(ix) + ": " + filename + " ..."])
+        # If a precomputed fingerprint for this soundfile already exists
+        # under outdir (e.g. from an earlier "precompute" run), load its
+        # hashes instead of re-decoding and re-analyzing the audio.
+        opfname = precompute_filename(
+            filename, outdir, audfprint_analyze.PRECOMPEXT, strip_prefix=strip_prefix
+        )
+        if (
+            os.path.splitext(filename)[1]
+            not in (audfprint_analyze.PRECOMPEXT, audfprint_analyze.PRECOMPPKEXT)
+            and os.path.isfile(opfname)
+        ):
+            report(["  using precomputed hashes from " + opfname])
+            hashes = audfprint_analyze.hashes_load(opfname)
+            # Duplicate the instrumentation from wavfile2hashes's
+            # precomputed-file branch.
+            dur = np.max(hashes, axis=0)[0] * analyzer.n_hop / analyzer.target_sr
+            analyzer.soundfiledur = dur
+            analyzer.soundfiletotaldur += dur
+            analyzer.soundfilecount += 1
+            hash_tab.store(filename, hashes)
+            nhash = len(hashes)
+        else:
+            dur, nhash = analyzer.ingest(hash_tab, filename)
+        tothashes += nhash
+        ix += 1
+
+    report(
+        [
+            "Added "
+            + str(tothashes)
+            + " hashes "
+            + "(%.1f" % (tothashes / float(analyzer.soundfiletotaldur))
+            + " hashes/sec)"
+        ]
+    )
+
+
+def _cmd_remove(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix,
+):
+    """Removing files from hash table."""
+    for filename in filename_iter:
+        hash_tab.remove(filename)
+
+
+def _cmd_list(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix,
+):
+    hash_tab.list(lambda x: report([x]))
+
+
+# Dispatch table for do_cmd: one dict lookup instead of a chain of
+# string compares per invocation.
+CMDS = {
+    "merge": _cmd_merge,
+    "newmerge": _cmd_merge,
+    "precompute": _cmd_precompute,
+    "match": _cmd_match,
+    "new": _cmd_new_add,
+    "add": _cmd_new_add,
+    "remove": _cmd_remove,
+    "list": _cmd_list,
+}
+
+
 def do_cmd(
     cmd,
     analyzer,
@@ -177,77 +364,65 @@ def do_cmd(
     """Breaks out the core part of running the command.
     This is just the single-core versions.
     """
-    if cmd == "merge" or cmd == "newmerge":
-        # files are other hash tables, merge them in
-        for filename in filename_iter:
-            hash_tab2 = hash_table.HashTable(filename)
-            if "samplerate" in hash_tab.params:
-                assert hash_tab.params["samplerate"] == hash_tab2.params["samplerate"]
-            else:
-                # "newmerge" fails to setup the samplerate param
-                hash_tab.params["samplerate"] = hash_tab2.params["samplerate"]
-            hash_tab.merge(hash_tab2)
-
-    elif cmd == "precompute":
-        # just precompute fingerprints, single core
-        for filename in filename_iter:
-            report(
-                file_precompute(
-                    analyzer,
-                    filename,
-                    outdir,
-                    type,
-                    skip_existing=skip_existing,
-                    strip_prefix=strip_prefix,
-                )
-            )
-
-    elif cmd == "match":
-        # Running query, single-core mode
-        for num, filename in enumerate(filename_iter):
-            msgs = matcher.file_match_to_msgs(analyzer, hash_tab, filename, num)
-            report(msgs)
+    try:
+        cmd_fn = CMDS[cmd]
+    except KeyError:
+        raise ValueError("unrecognized command: " + cmd)
+    cmd_fn(
+        analyzer,
+        hash_tab,
+        filename_iter,
+        matcher,
+        outdir,
+        type,
+        report,
+        skip_existing,
+        strip_prefix,
+    )
 
-    elif cmd == "new" or cmd == "add":
-        # Adding files
-        tothashes = 0
-        ix = 0
-        for filename in filename_iter:
-            report([time.ctime() + " ingesting #" + str(ix) + ": " + filename + " ..."])
-            dur, nhash = analyzer.ingest(hash_tab, filename)
-            tothashes += nhash
-            ix += 1
 
-        report(
-            [
-                "Added "
-                + str(tothashes)
-                + " hashes "
-                + "(%.1f" % (tothashes / float(analyzer.soundfiletotaldur))
-                + " hashes/sec)"
-            ]
-        )
-    elif cmd == "remove":
-        # Removing files from hash table.
-        for filename in filename_iter:
-            hash_tab.remove(filename)
+# multiprocessing context for the add workers, created on first use.
+_MP_CONTEXT = None
 
-    elif cmd == "list":
-        hash_tab.list(lambda x: report([x]))
 
-    else:
-        raise ValueError("unrecognized command: " + cmd)
+def _multiproc_context():
+    """Return the multiprocessing context used for the add workers.
+    Prefer "forkserver": children are forked from a slim server process
+    that has done its imports but never loads the (possibly GB-scale)
+    parent hash table, so per-worker RSS stays small.  The analyzer is
+    always passed as a pickled argument, never inherited."""
+    global _MP_CONTEXT
+    if _MP_CONTEXT is None:
+        try:
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(
+                ["numpy", "audfprint.audfprint_analyze", "audfprint.hash_table"]
+            )
+        except ValueError:
+            # Platform without forkserver (e.g. Windows) - use default.
+            ctx = multiprocessing.get_context()
+        _MP_CONTEXT = ctx
+    return _MP_CONTEXT
+
+
+def _threaded_add_worker(analyzer, hash_tab, filelist, lock):
+    """Analyze filelist and store into the shared hash_tab, locking
+    only around the store() appends.  Used when the FFT releases the
+    GIL (pyFFTW), so plain threads overlap the analysis."""
+    # Private analyzer copy: the instrumentation fields (soundfiledur
+    # etc.) are mutated per file.
+    analyzer = copy.copy(analyzer)
+    nhashes = 0
+    for filename in filelist:
+        hashes = analyzer.wavfile2hashes(filename)
+        with lock:
+            hash_tab.store(filename, hashes)
+        nhashes += len(hashes)
+    return len(filelist), nhashes
 
 
 def multiproc_add(analyzer, hash_tab, filename_iter, report, ncores):
     """Run multiple threads adding new files to hash table"""
-    # run ncores in parallel to add new files to existing HASH_TABLE
-    # lists store per-process parameters
-    # Pipes to transfer results
-    rx = [[] for _ in range(ncores)]
-    tx = [[] for _ in range(ncores)]
-    # Process objects
-    pr = [[] for _ in range(ncores)]
     # Lists of the distinct files
     filelists = [[] for _ in range(ncores)]
     # unpack all the files into ncores lists
@@ -255,10 +430,44 @@ def multiproc_add(analyzer, hash_tab, filename_iter, report, ncores):
     for filename in filename_iter:
         filelists[ix % ncores].append(filename)
         ix += 1
+    if stft.HAVE_PYFFTW:
+        # FFTW drops the GIL during the transforms, so threads get the
+        # parallelism without per-worker tables or the shared-memory
+        # handoff - they store straight into the common hash_tab.
+        lock = threading.Lock()
+        with ThreadPoolExecutor(ncores) as pool:
+            futures = [
+                pool.submit(
+                    _threaded_add_worker, analyzer, hash_tab, filelists[ix], lock
+                )
+                for ix in range(ncores)
+            ]
+            for core, future in enumerate(futures):
+                nfiles, nhashes = future.result()
+                report(
+                    [
+                        "thread "
+                        + str(core)
+                        + " added "
+                        + str(nfiles)
+                        + " files ("
+                        + str(nhashes)
+                        + " hashes)"
+                    ]
+                )
+        return
+    # run ncores in parallel to add new files to existing HASH_TABLE
+    ctx = _multiproc_context()
+    # lists store per-process parameters
+    # Pipes to transfer results
+    rx = [[] for _ in range(ncores)]
+    tx = [[] for _ in range(ncores)]
+    # Process objects
+    pr = [[] for _ in range(ncores)]
     # Launch each of the individual processes
     for ix in range(ncores):
-        rx[ix], tx[ix] = multiprocessing.Pipe(False)
-        pr[ix] = multiprocessing.Process(
+        rx[ix], tx[ix] = ctx.Pipe(False)
+        pr[ix] = ctx.Process(
             target=make_ht_from_list,
             args=(
                 analyzer,
@@ -271,9 +480,13 @@ def multiproc_add(analyzer, hash_tab, filename_iter, report, ncores):
         )
         pr[ix].start()
     # gather results when they all finish
+    tables = []
+    shms = []
     for core in range(ncores):
-        # thread passes back serialized hash table structure
-        hash_tabx = rx[core].recv()
+        # thread passes back the names of its shared-memory blocks
+        hash_tabx, table_shm, counts_shm = _attach_shared_hash_table(
+            hash_tab, rx[core].recv()
+        )
         report(
             [
                 "hash_table "
@@ -285,17 +498,181 @@ def multiproc_add(analyzer, hash_tab, filename_iter, report, ncores):
                 + " hashes"
             ]
         )
-        # merge in all the new items, hash entries
-        hash_tab.merge(hash_tabx)
+        tables.append(hash_tabx)
+        shms.append((table_shm, counts_shm))
+    # merge in all the new items, hash entries, in one bulk pass
+    hash_tab.bulk_merge(tables)
+    # Drop our views before closing the underlying buffers, then free
+    # the blocks - the workers handed ownership to us.
+    del tables
+    for core in range(ncores):
+        for shm in shms[core]:
+            shm.close()
+            shm.unlink()
         # finish that thread...
         pr[core].join()
 
 
-def matcher_file_match_to_msgs(matcher, analyzer, hash_tab, filename):
-    """Cover for matcher.file_match_to_msgs so it can be passed to joblib"""
+def _attach_shared_hash_table(hash_tab, meta):
+    """Map the shared-memory blocks described by a worker's meta tuple
+    and dress the zero-copy views up as a HashTable for merging;
+    __init__ is skipped so no second full-size table is allocated.
+    Returns (hash_tabx, table_shm, counts_shm)."""
+    (
+        table_name,
+        table_shape,
+        table_dtype,
+        counts_name,
+        counts_shape,
+        counts_dtype,
+        names,
+        hashesperid,
+        params,
+    ) = meta
+    table_shm = shared_memory.SharedMemory(name=table_name)
+    counts_shm = shared_memory.SharedMemory(name=counts_name)
+    hash_tabx = hash_table.HashTable.__new__(hash_table.HashTable)
+    hash_tabx.hashbits = hash_tab.hashbits
+    hash_tabx.depth = hash_tab.depth
+    hash_tabx.maxtimebits = hash_tab.maxtimebits
+    hash_tabx.table = np.ndarray(table_shape, table_dtype, buffer=table_shm.buf)
+    hash_tabx.counts = np.ndarray(counts_shape, counts_dtype, buffer=counts_shm.buf)
+    hash_tabx.names = names
+    hash_tabx.hashesperid = hashesperid
+    hash_tabx.params = params
+    return hash_tabx, table_shm, counts_shm
+
+
+def _pool_chunksize(nfiles, ncores):
+    """Pick a chunksize for ProcessPoolExecutor.map: a few chunks per
+    core to balance scheduling slack against per-task IPC overhead."""
+    return max(1, nfiles // (ncores * 4))
+
+
+# Each precompute pool worker builds its own analyzer once, at startup,
+# instead of unpickling a copy of the parent's with every task.
+_WORKER_ANALYZER = None
+
+
+def _init_precompute_worker(docopt_args):
+    """Pool initializer: construct this worker's analyzer from the
+    parsed command-line args."""
+    global _WORKER_ANALYZER
+    _WORKER_ANALYZER = setup_analyzer(docopt_args)
+
+
+def _file_precompute_worker(
+    filename, precompdir, type="peaks", skip_existing=False, strip_prefix=None
+):
+    """Pool worker for precompute, using this process's analyzer."""
+    return file_precompute(
+        _WORKER_ANALYZER,
+        filename,
+        precompdir,
+        type,
+        skip_existing=skip_existing,
+        strip_prefix=strip_prefix,
+    )
+
+
+# Per-process match state, set up by the pool initializer.
+_WORKER_MATCH_STATE = None
+
+
+def _init_match_worker(matcher, analyzer, hash_tab):
+    """Stash the match state in this worker process.  The hash table
+    crosses to each worker once, at pool startup, instead of being
+    re-pickled with every chunk of filenames."""
+    global _WORKER_MATCH_STATE
+    _WORKER_MATCH_STATE = (matcher, analyzer, hash_tab)
+
+
+def _file_match_worker(filename):
+    """Pool worker for match, using this process's matcher state."""
+    matcher, analyzer, hash_tab = _WORKER_MATCH_STATE
     return matcher.file_match_to_msgs(analyzer, hash_tab, filename)
 
 
+def _cmd_multiproc_precompute(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix, ncores, docopt_args,
+):
+    """precompute fingerprints with a process pool"""
+    files = list(filename_iter)
+    if docopt_args is not None:
+        # Each worker constructs its own analyzer once, in the pool
+        # initializer, so per-task IPC is just the filename.
+        pool_kwargs = {
+            "initializer": _init_precompute_worker,
+            "initargs": (docopt_args,),
+        }
+        worker = functools.partial(
+            _file_precompute_worker,
+            precompdir=outdir,
+            type=type,
+            skip_existing=skip_existing,
+            strip_prefix=strip_prefix,
+        )
+    else:
+        # No parsed args available: ship the analyzer with each task.
+        pool_kwargs = {}
+        worker = functools.partial(
+            file_precompute,
+            analyzer,
+            precompdir=outdir,
+            type=type,
+            skip_existing=skip_existing,
+            strip_prefix=strip_prefix,
+        )
+    with ProcessPoolExecutor(max_workers=ncores, **pool_kwargs) as executor:
+        # Chunked map keeps per-task IPC down; results stream back
+        # in order so we can report as each chunk completes instead
+        # of waiting for the slowest worker.
+        for msgs in executor.map(
+            worker,
+            files,
+            chunksize=_pool_chunksize(len(files), ncores),
+        ):
+            report(msgs)
+
+
+def _cmd_multiproc_match(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix, ncores, docopt_args,
+):
+    """Running queries in parallel"""
+    files = list(filename_iter)
+    with ProcessPoolExecutor(
+        max_workers=ncores,
+        initializer=_init_match_worker,
+        initargs=(matcher, analyzer, hash_tab),
+    ) as executor:
+        for msgs in executor.map(
+            _file_match_worker,
+            files,
+            chunksize=_pool_chunksize(len(files), ncores),
+        ):
+            report(msgs)
+
+
+def _cmd_multiproc_new_add(
+    analyzer, hash_tab, filename_iter, matcher, outdir, type, report,
+    skip_existing, strip_prefix, ncores, docopt_args,
+):
+    """We add by forking multiple parallel threads each running
+    analyzers over different subsets of the file list"""
+    multiproc_add(analyzer, hash_tab, filename_iter, report, ncores)
+
+
+# Dispatch table for do_cmd_multiproc
+MULTIPROC_CMDS = {
+    "precompute": _cmd_multiproc_precompute,
+    "match": _cmd_multiproc_match,
+    "new": _cmd_multiproc_new_add,
+    "add": _cmd_multiproc_new_add,
+}
+
+
 def do_cmd_multiproc(
     cmd,
     analyzer,
@@ -308,41 +685,27 @@ def do_cmd_multiproc(
     skip_existing=False,
     strip_prefix=None,
     ncores=1,
+    docopt_args=None,
 ):
     """Run the actual command, using multiple processors"""
-    if cmd == "precompute":
-        # precompute fingerprints with joblib
-        msgslist = joblib.Parallel(n_jobs=ncores)(
-            joblib.delayed(file_precompute)(
-                analyzer, file, outdir, type, skip_existing, strip_prefix=strip_prefix
-            )
-            for file in filename_iter
-        )
-        # Collapse into a single list of messages
-        for msgs in msgslist:
-            report(msgs)
-
-    elif cmd == "match":
-        # Running queries in parallel
-        msgslist = joblib.Parallel(n_jobs=ncores)(
-            # Would use matcher.file_match_to_msgs(), but you
-            # can't use joblib on an instance method
-            joblib.delayed(matcher_file_match_to_msgs)(
-                matcher, analyzer, hash_tab, filename
-            )
-            for filename in filename_iter
-        )
-        for msgs in msgslist:
-            report(msgs)
-
-    elif cmd == "new" or cmd == "add":
-        # We add by forking multiple parallel threads each running
-        # analyzers over different subsets of the file list
-        multiproc_add(analyzer, hash_tab, filename_iter, report, ncores)
-
-    else:
+    try:
+        cmd_fn = MULTIPROC_CMDS[cmd]
+    except KeyError:
         # This is not a multiproc command
         raise ValueError("unrecognized multiproc command: " + cmd)
+    cmd_fn(
+        analyzer,
+        hash_tab,
+        filename_iter,
+        matcher,
+        outdir,
+        type,
+        report,
+        skip_existing,
+        strip_prefix,
+        ncores,
+        docopt_args,
+    )
 
 
 # Command to separate out setting of analyzer parameters
@@ -365,6 +728,11 @@ def setup_analyzer(args):
         # Default shift is 4 for match, otherwise 1
         analyzer.shifts = 4 if args["match"] else 1
     analyzer.fail_on_error = not args["--continue-on-error"]
+    # Compile the pairing kernel specialized to these constants now,
+    # before any worker processes are forked from us.
+    audfprint_analyze.specialized_pair_kernel(
+        analyzer.mindt, analyzer.targetdt, analyzer.targetdf, analyzer.maxpairsperpeak
+    )
     return analyzer
 
 
@@ -393,19 +761,21 @@ def setup_reporter(args):
     """Creates a logging function, either to stderr or file"""
     opfile = args["--opfile"]
     if opfile and len(opfile):
-        f = open(opfile, "w")
+        # Large buffer so bursts of messages (e.g. from the multiproc
+        # match workers) coalesce into a few big writes; flushed at exit.
+        f = io.BufferedWriter(open(opfile, "wb", buffering=0), buffer_size=1 << 20)
+        atexit.register(f.flush)
 
         def report(msglist):
             """Log messages to a particular output file"""
-            for msg in msglist:
-                f.write(msg + "\n")
+            f.writelines((msg + "\n").encode() for msg in msglist)
 
     else:
 
         def report(msglist):
             """Log messages by printing to stdout"""
-            for msg in msglist:
-                print(msg)
+            if msglist:
+                sys.stdout.write("\n".join(msglist) + "\n")
 
     return report
 
@@ -574,6 +944,7 @@ def main(argv):
             skip_existing=args["--skip-existing"],
             strip_prefix=args["--wavdir"],
             ncores=ncores,
+            docopt_args=args,
         )
     else:
         do_cmd(
@@ -12,8 +12,6 @@ from __future__ import division, print_function
 # For glob2hashtable, localtester
 import glob
 import os
-# For reading/writing hashes to file
-import struct
 import time
 
 import numpy as np
@@ -48,6 +46,18 @@ def locmax(vec, indices=False):
         return maxmask
 
 
+def locmax_columns(sgram):
+    """Return a boolean array flagging the columnwise local maxima of sgram.
+    Equivalent to applying locmax to each column in turn, but computed
+    as a single vectorized pass by comparing the whole array to
+    shifted copies of itself.
+    """
+    nbr = np.zeros((sgram.shape[0] + 1,) + sgram.shape[1:], dtype=bool)
+    nbr[0] = True
+    nbr[1:-1] = np.greater_equal(sgram[1:], sgram[:-1])
+    return nbr[:-1] & ~nbr[1:]
+
+
 # Constants for Analyzer
 # DENSITY controls the density of landmarks found (approx DENSITY per sec)
 DENSITY = 20.0
@@ -93,6 +103,246 @@ def landmarks2hashes(landmarks):
     return hashes
 
 
+# The landmark-pairing loop is the hottest pure-Python code left in the
+# analyzer, so we compile it with numba when that is available.  The
+# import is deferred until the first soundfile is analyzed so that CLI
+# startup (docopt etc.) is not slowed by loading LLVM.
+_PAIR_KERNEL = None
+
+
+def _pair_peaks(pkcols, pkbins, mindt, targetdt, targetdf, maxpairs):
+    """Inner loop of peaks2landmarks: pair up column-sorted peaks into
+    (col, bin1, bin2, dcol) landmark rows.  Written so it can be
+    compiled by numba.njit, but also runs as plain Python.
+    """
+    npks = len(pkcols)
+    landmarks = np.empty((npks * maxpairs, 4), np.int32)
+    nlm = 0
+    for i in range(npks):
+        pairsthispeak = 0
+        for j in range(i + 1, npks):
+            dcol = pkcols[j] - pkcols[i]
+            if dcol >= targetdt:
+                # pklist is column-sorted, so no more pairable peaks
+                break
+            if dcol < mindt:
+                continue
+            if pairsthispeak >= maxpairs:
+                break
+            if abs(pkbins[j] - pkbins[i]) < targetdf:
+                # We have a pair!
+                landmarks[nlm, 0] = pkcols[i]
+                landmarks[nlm, 1] = pkbins[i]
+                landmarks[nlm, 2] = pkbins[j]
+                landmarks[nlm, 3] = dcol
+                nlm += 1
+                pairsthispeak += 1
+    return landmarks[:nlm]
+
+
+def _fwd_prune_kernel(sgram, colmax, sthresh, sp_vals, a_dec, maxpksperframe):
+    """Forward decaying-threshold prune: numba-compilable version of
+    Analyzer._decaying_threshold_fwd_prune.  colmax is the columnwise
+    local-max mask, sthresh the initial threshold envelope (updated in
+    place), sp_vals the cached Gaussian spreading profile."""
+    srows, scols = sgram.shape
+    peaks = np.zeros((srows, scols))
+    cand = np.empty(srows, np.int64)
+    for col in range(scols):
+        # Find local magnitude peaks that are above threshold
+        ncand = 0
+        for row in range(srows):
+            if colmax[row, col] and sgram[row, col] > sthresh[row]:
+                cand[ncand] = row
+                ncand += 1
+        # Work down the peaks in order of their absolute value above
+        # threshold (ties broken towards the higher bin, matching the
+        # tuple sort in the pure-Python version)
+        npick = min(maxpksperframe, ncand)
+        for _ in range(npick):
+            bestk = -1
+            bestrow = -1
+            bestval = 0.0
+            for k in range(ncand):
+                row = cand[k]
+                if row >= 0:
+                    val = sgram[row, col]
+                    if bestk < 0 or val > bestval or (
+                            val == bestval and row > bestrow):
+                        bestk = k
+                        bestrow = row
+                        bestval = val
+            cand[bestk] = -1
+            # Raise the threshold envelope with this peak's Gaussian
+            for i in range(srows):
+                spread = bestval * sp_vals[srows - bestrow + i]
+                if spread > sthresh[i]:
+                    sthresh[i] = spread
+            peaks[bestrow, col] = 1
+        for i in range(srows):
+            sthresh[i] *= a_dec
+    return peaks
+
+
+def _bwd_prune_kernel(sgram, peaks, sthresh, sp_vals, a_dec):
+    """Backward decaying-threshold prune: numba-compilable version of
+    Analyzer._decaying_threshold_bwd_prune_peaks.  Modifies peaks in
+    place and returns it."""
+    srows, scols = sgram.shape
+    cand = np.empty(srows, np.int64)
+    for col in range(scols, 0, -1):
+        ncand = 0
+        for row in range(srows):
+            if peaks[row, col - 1] != 0:
+                cand[ncand] = row
+                ncand += 1
+        # Process in descending (value, bin) order as above
+        for _ in range(ncand):
+            bestk = -1
+            bestrow = -1
+            bestval = 0.0
+            for k in range(ncand):
+                row = cand[k]
+                if row >= 0:
+                    val = sgram[row, col - 1]
+                    if bestk < 0 or val > bestval or (
+                            val == bestval and row > bestrow):
+                        bestk = k
+                        bestrow = row
+                        bestval = val
+            cand[bestk] = -1
+            if bestval >= sthresh[bestrow]:
+                # Setup the threshold
+                for i in range(srows):
+                    spread = bestval * sp_vals[srows - bestrow + i]
+                    if spread > sthresh[i]:
+                        sthresh[i] = spread
+                # Delete any following peak (threshold should, but be sure)
+                if col < scols:
+                    peaks[bestrow, col] = 0
+            else:
+                # delete the peak
+                peaks[bestrow, col - 1] = 0
+        for i in range(srows):
+            sthresh[i] *= a_dec
+    return peaks
+
+
+_PRUNE_KERNELS = None
+_PRUNE_KERNELS_TRIED = False
+
+
+def _get_prune_kernels():
+    """Return (fwd, bwd) numba-compiled prune kernels, or None if numba
+    is unavailable.  The threshold recursion runs frame by frame, so
+    these stay serial njit (no prange); cache=True means later runs of
+    this short-lived CLI skip the LLVM compile."""
+    global _PRUNE_KERNELS, _PRUNE_KERNELS_TRIED
+    if not _PRUNE_KERNELS_TRIED:
+        _PRUNE_KERNELS_TRIED = True
+        try:
+            import numba
+        except ImportError:
+            return None
+        njit = numba.njit(nogil=True, cache=True)
+        fwd = njit(_fwd_prune_kernel)
+        bwd = njit(_bwd_prune_kernel)
+        # Warm the dispatcher with a tiny dummy call so the first real
+        # soundfile doesn't pay the compile (cached after first run).
+        tiny = np.zeros((4, 3))
+        sp_vals = np.zeros(9)
+        fwd(tiny, np.zeros((4, 3), dtype=bool), np.zeros(4), sp_vals, 0.5, 1)
+        bwd(tiny, np.zeros((4, 3)), np.zeros(4), sp_vals, 0.5)
+        _PRUNE_KERNELS = (fwd, bwd)
+    return _PRUNE_KERNELS
+
+
+def _get_pair_kernel():
+    """Return the peak-pairing kernel, numba-compiled if possible.
+    nogil=True lets the multiprocessing workers overlap; cache=True
+    avoids recompiling on every process launch."""
+    global _PAIR_KERNEL
+    if _PAIR_KERNEL is None:
+        try:
+            import numba
+            _PAIR_KERNEL = numba.njit(nogil=True, cache=True, fastmath=True)(
+                _pair_peaks
+            )
+        except ImportError:
+            _PAIR_KERNEL = _pair_peaks
+    return _PAIR_KERNEL
+
+
+# Source template for a pairing kernel specialized to one set of
+# analyzer constants.  Baking mindt/targetdt/targetdf/maxpairs in as
+# literals lets numba constant-fold the comparisons and unroll the
+# fanout bound, which the generic kernel cannot do with them as
+# runtime arguments.  Body mirrors _pair_peaks above.
+_PAIR_KERNEL_TEMPLATE = """
+def _pair_peaks_{tag}(pkcols, pkbins):
+    npks = len(pkcols)
+    landmarks = np.empty((npks * {maxpairs}, 4), np.int32)
+    nlm = 0
+    for i in range(npks):
+        pairsthispeak = 0
+        for j in range(i + 1, npks):
+            dcol = pkcols[j] - pkcols[i]
+            if dcol >= {targetdt}:
+                break
+            if dcol < {mindt}:
+                continue
+            if pairsthispeak >= {maxpairs}:
+                break
+            if abs(pkbins[j] - pkbins[i]) < {targetdf}:
+                landmarks[nlm, 0] = pkcols[i]
+                landmarks[nlm, 1] = pkbins[i]
+                landmarks[nlm, 2] = pkbins[j]
+                landmarks[nlm, 3] = dcol
+                nlm += 1
+                pairsthispeak += 1
+    return landmarks[:nlm]
+"""
+
+# Compiled specializations, keyed on the baked-in constants.  Kept at
+# module level (not on the Analyzer) so analyzers stay picklable for
+# the multiprocessing workers; None records that numba is unavailable.
+_SPECIALIZED_PAIR_KERNELS = {}
+
+
+def specialized_pair_kernel(mindt, targetdt, targetdf, maxpairs):
+    """Return a pairing kernel with these constants compiled in as
+    literals, or None if numba is not available.  Compilation happens
+    once per constant set per process (the exec'd source has no file
+    behind it, so numba's on-disk cache cannot be used)."""
+    key = (mindt, targetdt, targetdf, maxpairs)
+    if key not in _SPECIALIZED_PAIR_KERNELS:
+        try:
+            import numba
+        except ImportError:
+            _SPECIALIZED_PAIR_KERNELS[key] = None
+        else:
+            tag = "%d_%d_%d_%d" % key
+            namespace = {"np": np}
+            exec(
+                _PAIR_KERNEL_TEMPLATE.format(
+                    tag=tag,
+                    mindt=mindt,
+                    targetdt=targetdt,
+                    targetdf=targetdf,
+                    maxpairs=maxpairs,
+                ),
+                namespace,
+            )
+            kernel = numba.njit(nogil=True, fastmath=True)(
+                namespace["_pair_peaks_" + tag]
+            )
+            # Warm-up call so the compile happens now (e.g. during
+            # setup_analyzer, before any workers are forked).
+            kernel(np.zeros(0, np.int32), np.zeros(0, np.int32))
+            _SPECIALIZED_PAIR_KERNELS[key] = kernel
+    return _SPECIALIZED_PAIR_KERNELS[key]
+
+
 def hashes2landmarks(hashes):
     """Convert the mashed-up landmarks in hashes back into a list
     of (time, bin1, bin2, dtime) tuples.
@@ -139,6 +389,13 @@ class Analyzer(object):
         self.mindt = 2
         # max lookahead in time (LIMITED TO <64 IN LANDMARK2HASH)
         self.targetdt = 63
+        # streaming block length in secs - long soundfiles are peak-picked
+        # in blocks of this size so memory stays O(block), not O(file)
+        self.block_s = 120.0
+        # minimum analysis margin on each side of the frames a block is
+        # responsible for; widened at analysis time to several decay
+        # constants of the masking threshold (see wavfile2peaks)
+        self.block_margin_s = 1.0
         # global stores duration of most recently-read soundfile
         self.soundfiledur = 0.0
         # .. and total amount of sound processed
@@ -188,11 +445,21 @@ class Analyzer(object):
             self.__sp_vals = np.exp(
                 -0.5 * ((np.arange(-npoints, npoints + 1) / width) ** 2)
             )
-        # Now the actual function
-        for pos, val in peaks:
-            vec = np.maximum(
-                vec, val * self.__sp_vals[np.arange(npoints) + npoints - pos]
+        # Now the actual function: broadcast a block of peaks against the
+        # cached profile and reduce with np.maximum, instead of looping
+        # one Gaussian at a time.  Blocks of 256 peaks cap the temporary
+        # at 256 x npoints doubles.
+        peaks = list(peaks)
+        binvals = np.arange(npoints)
+        for blockstart in range(0, len(peaks), 256):
+            block = peaks[blockstart:blockstart + 256]
+            poss = np.array([pos for pos, _ in block])
+            vals = np.array([val for _, val in block])
+            spread = (
+                vals[:, np.newaxis]
+                * self.__sp_vals[binvals[np.newaxis, :] + npoints - poss[:, np.newaxis]]
             )
+            vec = np.maximum(vec, np.maximum.reduce(spread))
         return vec
 
     def _decaying_threshold_fwd_prune(self, sgram, a_dec):
@@ -203,17 +470,30 @@ class Analyzer(object):
         sthresh = self.spreadpeaksinvector(
             np.max(sgram[:, : np.minimum(10, scols)], axis=1), self.f_sd
         )
+        kernels = _get_prune_kernels()
+        if kernels:
+            return kernels[0](
+                sgram,
+                locmax_columns(sgram),
+                sthresh,
+                np.asarray(self.__sp_vals),
+                a_dec,
+                self.maxpksperframe,
+            )
         # Store sthresh at each column, for debug
         # thr = np.zeros((srows, scols))
         peaks = np.zeros((srows, scols))
         # optimization of mask update
         __sp_pts = len(sthresh)
         __sp_v = self.__sp_vals
+        # Find all the columnwise local maxima at once, rather than
+        # redoing the neighbor comparisons for every column.
+        colmax = locmax_columns(sgram)
 
         for col in range(scols):
             s_col = sgram[:, col]
             # Find local magnitude peaks that are above threshold
-            sdmaxposs = np.nonzero(locmax(s_col) * (s_col > sthresh))[0]
+            sdmaxposs = np.nonzero(colmax[:, col] & (s_col > sthresh))[0]
             # Work down list of peaks in order of their absolute value
             # above threshold
             valspeaks = sorted(zip(s_col[sdmaxposs], sdmaxposs), reverse=True)
@@ -235,6 +515,11 @@ class Analyzer(object):
         scols = np.shape(sgram)[1]
         # Backwards filter to prune peaks
         sthresh = self.spreadpeaksinvector(sgram[:, -1], self.f_sd)
+        kernels = _get_prune_kernels()
+        if kernels:
+            return kernels[1](
+                sgram, peaks, sthresh, np.asarray(self.__sp_vals), a_dec
+            )
         for col in range(scols, 0, -1):
             pkposs = np.nonzero(peaks[:, col - 1])[0]
             peakvals = sgram[pkposs, col - 1]
@@ -253,6 +538,14 @@ class Analyzer(object):
             sthresh = a_dec * sthresh
         return peaks
 
+    def _masking_decay(self):
+        """Per-frame decay constant of the peak masking envelope.
+        The envelope's memory is ~1/(1 - a_dec) frames, which also
+        sizes the analysis margins for streamed blocks."""
+        return (1 - 0.01 * (self.density * np.sqrt(self.n_hop / 352.8) / 35)) ** (
+            1 / OVERSAMP
+        )
+
     def find_peaks(self, d, sr):
         """Find the local peaks in the spectrogram as basis for fingerprints.
             Returns a list of (time_frame, freq_bin) pairs.
@@ -275,9 +568,7 @@ class Analyzer(object):
             return []
 
         # masking envelope decay constant
-        a_dec = (1 - 0.01 * (self.density * np.sqrt(self.n_hop / 352.8) / 35)) ** (
-            1 / OVERSAMP
-        )
+        a_dec = self._masking_decay()
         # Take spectrogram
         mywin = np.hanning(self.n_fft + 2)[1:-1]
         sgram = np.abs(
@@ -293,11 +584,9 @@ class Analyzer(object):
             print("find_peaks: Warning: input signal is identically zero.")
         # High-pass filter onset emphasis
         # [:-1,] discards top bin (nyquist) of sgram so bins fit in 8 bits
-        sgram = np.array(
-            [
-                scipy.signal.lfilter([1, -1], [1, -(HPF_POLE ** (1 / OVERSAMP))], s_row)
-                for s_row in sgram
-            ]
+        # Filter all the rows in one call instead of one lfilter per row.
+        sgram = scipy.signal.lfilter(
+            [1, -1], [1, -(HPF_POLE ** (1 / OVERSAMP))], sgram, axis=1
         )[
             :-1,
         ]
@@ -307,59 +596,105 @@ class Analyzer(object):
         # Further prune these peaks working backwards in time, to remove small peaks
         # that are closely followed by a large peak
         peaks = self._decaying_threshold_bwd_prune_peaks(sgram, peaks, a_dec)
-        # build a list of peaks we ended up with
-        scols = np.shape(sgram)[1]
-        pklist = []
-        for col in range(scols):
-            for bin_ in np.nonzero(peaks[:, col])[0]:
-                pklist.append((col, bin_))
-        return pklist
+        # build a list of peaks we ended up with - np.nonzero on the
+        # transpose gives the (col, bin) pairs already in column order.
+        pkcols, pkbins = np.nonzero(peaks.T)
+        return list(zip(pkcols, pkbins))
 
     def peaks2landmarks(self, pklist):
         """Take a list of local peaks in spectrogram
         and form them into pairs as landmarks.
         pklist is a column-sorted list of (col, bin) pairs as created
         by findpeaks().
-        Return a list of (col, peak, peak2, col2-col) landmark descriptors.
+        Return an np.array of (col, peak, peak2, col2-col) landmark rows.
         """
-        # Form pairs of peaks into landmarks
-        landmarks = []
-        if len(pklist) > 0:
-            # Find column of the final peak in the list
-            scols = pklist[-1][0] + 1
-            # Convert (col, bin) list into peaks_at[col] lists
-            peaks_at = [[] for _ in range(scols)]
-            for (col, bin_) in pklist:
-                peaks_at[col].append(bin_)
-
-            # Build list of landmarks <starttime F1 endtime F2>
-            for col in range(scols):
-                for peak in peaks_at[col]:
-                    pairsthispeak = 0
-                    for col2 in range(
-                        col + self.mindt, min(scols, col + self.targetdt)
-                    ):
-                        if pairsthispeak < self.maxpairsperpeak:
-                            for peak2 in peaks_at[col2]:
-                                if abs(peak2 - peak) < self.targetdf:
-                                    # and abs(peak2-peak) + abs(col2-col) > 2 ):
-                                    if pairsthispeak < self.maxpairsperpeak:
-                                        # We have a pair!
-                                        landmarks.append((col, peak, peak2, col2 - col))
-                                        pairsthispeak += 1
-
-        return landmarks
+        if len(pklist) == 0:
+            return np.zeros((0, 4), np.int32)
+        # Form pairs of peaks into landmarks in the (possibly
+        # numba-compiled) kernel.
+        peaks = np.asarray(pklist, dtype=np.int32)
+        pkcols = np.ascontiguousarray(peaks[:, 0])
+        pkbins = np.ascontiguousarray(peaks[:, 1])
+        # Prefer a kernel specialized to this analyzer's constants.
+        pair_kernel = specialized_pair_kernel(
+            self.mindt, self.targetdt, self.targetdf, self.maxpairsperpeak
+        )
+        if pair_kernel is not None:
+            return pair_kernel(pkcols, pkbins)
+        return _get_pair_kernel()(
+            pkcols,
+            pkbins,
+            self.mindt,
+            self.targetdt,
+            self.targetdf,
+            self.maxpairsperpeak,
+        )
 
     def wavfile2peaks(self, filename, shifts=None):
         """Read a soundfile and return its landmark peaks as a
         list of (time, bin) pairs.  If specified, resample to sr first.
         shifts > 1 causes hashes to be extracted from multiple shifts of
-        waveform, to reduce frame effects."""
+        waveform, to reduce frame effects.  Unshifted analysis streams
+        the file in block_s-second blocks, so memory stays proportional
+        to the block length, not the file length."""
         ext = os.path.splitext(filename)[1]
         if ext == PRECOMPPKEXT:
             # short-circuit - precomputed fingerprint file
             peaks = peaks_load(filename)
             dur = np.max(peaks, axis=0)[0] * self.n_hop / self.target_sr
+        elif shifts is None or shifts < 2:
+            # Stream the waveform in overlapping blocks, peak-picking
+            # each one as it arrives.  Blocks are hop-aligned so frame
+            # indices translate directly.  The masking threshold carries
+            # ~1/(1 - a_dec) frames of memory in both prune directions,
+            # so a block only owns frames with several decay constants
+            # of context on each side: a head margin to rebuild the
+            # forward threshold, and a tail margin so the backward prune
+            # sees the peaks that would have masked its last frames.
+            marginframes = max(
+                int(np.ceil(self.block_margin_s * self.target_sr / self.n_hop)),
+                int(np.ceil(3.0 / (1.0 - self._masking_decay()))),
+            )
+            blockframes = max(
+                int(round(self.block_s * self.target_sr / self.n_hop)),
+                4 * marginframes,
+            )
+            blocksamps = blockframes * self.n_hop
+            overlapsamps = 2 * marginframes * self.n_hop
+            peaks = []
+            tailpeaks = []
+            dur = 0.0
+            try:
+                for start_samp, d_block in audio_read.audio_read_blocks(
+                    filename,
+                    sr=self.target_sr,
+                    channels=1,
+                    block_samps=blocksamps,
+                    overlap_samps=overlapsamps,
+                ):
+                    dur = (start_samp + len(d_block)) / self.target_sr
+                    startframe = start_samp // self.n_hop
+                    minframe = marginframes if start_samp else 0
+                    # Tail frames of the previous block are re-analyzed
+                    # with full context in this block; drop its margin.
+                    tailpeaks = []
+                    ownend = len(d_block) // self.n_hop - marginframes
+                    for col, bin_ in self.find_peaks(d_block, self.target_sr):
+                        if col < minframe:
+                            continue
+                        if col < ownend:
+                            peaks.append((col + startframe, bin_))
+                        else:
+                            tailpeaks.append((col + startframe, bin_))
+                # The final block has no successor, so it keeps its tail.
+                peaks.extend(tailpeaks)
+            except Exception as e:  # audioread.NoBackendError:
+                message = "wavfile2peaks: Error reading " + filename
+                if self.fail_on_error:
+                    print(e)
+                    raise IOError(message)
+                print(message, "skipping")
+                peaks = []
         else:
             try:
                 # [d, sr] = librosa.load(filename, sr=self.target_sr)
@@ -374,15 +709,12 @@ class Analyzer(object):
                 sr = self.target_sr
             # Store duration in a global because it's hard to handle
             dur = len(d) / sr
-            if shifts is None or shifts < 2:
-                peaks = self.find_peaks(d, sr)
-            else:
-                # Calculate hashes with optional part-frame shifts
-                peaklists = []
-                for shift in range(shifts):
-                    shiftsamps = int(shift / self.shifts * self.n_hop)
-                    peaklists.append(self.find_peaks(d[shiftsamps:], sr))
-                peaks = peaklists
+            # Calculate hashes with optional part-frame shifts
+            peaklists = []
+            for shift in range(shifts):
+                shiftsamps = int(shift / self.shifts * self.n_hop)
+                peaklists.append(self.find_peaks(d[shiftsamps:], sr))
+            peaks = peaklists
 
         # instrumentation to track total amount of sound processed
         self.soundfiledur = dur
@@ -471,10 +803,7 @@ class Analyzer(object):
 
 # ########## functions to read/write hashes to file for a single track #### #
 
-# Format string for writing binary data to file
-HASH_FMT = "<2i"
 HASH_MAGIC = b"audfprinthashV00"  # 16 chars, FWIW
-PEAK_FMT = "<2i"
 PEAK_MAGIC = b"audfprintpeakV00"  # 16 chars, FWIW
 
 
@@ -482,46 +811,36 @@ def hashes_save(hashfilename, hashes):
     """Write out a list of (time, hash) pairs as 32 bit ints"""
     with open(hashfilename, "wb") as f:
         f.write(HASH_MAGIC)
-        for time_, hash_ in hashes:
-            f.write(struct.pack(HASH_FMT, time_, hash_))
+        # One bulk write of the little-endian int32 pairs; byte-for-byte
+        # the same file as packing each pair with struct's "<2i".
+        np.asarray(hashes, dtype=np.int32).astype("<i4").tofile(f)
 
 
 def hashes_load(hashfilename):
     """Read back a set of hashes written by hashes_save"""
-    hashes = []
-    fmtsize = struct.calcsize(HASH_FMT)
     with open(hashfilename, "rb") as f:
         magic = f.read(len(HASH_MAGIC))
         if magic != HASH_MAGIC:
             raise IOError("%s is not a hash file (magic %s)" % (hashfilename, magic))
-        data = f.read(fmtsize)
-        while data is not None and len(data) == fmtsize:
-            hashes.append(struct.unpack(HASH_FMT, data))
-            data = f.read(fmtsize)
-    return hashes
+        hashes = np.fromfile(f, dtype="<i4")
+    return hashes.astype(np.int32).reshape(-1, 2)
 
 
 def peaks_save(peakfilename, peaks):
     """Write out a list of (time, bin) pairs as 32 bit ints"""
     with open(peakfilename, "wb") as f:
         f.write(PEAK_MAGIC)
-        for time_, bin_ in peaks:
-            f.write(struct.pack(PEAK_FMT, time_, bin_))
+        np.asarray(peaks, dtype=np.int32).astype("<i4").tofile(f)
 
 
 def peaks_load(peakfilename):
     """Read back a set of (time, bin) pairs written by peaks_save"""
-    peaks = []
-    fmtsize = struct.calcsize(PEAK_FMT)
     with open(peakfilename, "rb") as f:
         magic = f.read(len(PEAK_MAGIC))
         if magic != PEAK_MAGIC:
             raise IOError("%s is not a peak file (magic %s)" % (peakfilename, magic))
-        data = f.read(fmtsize)
-        while data is not None and len(data) == fmtsize:
-            peaks.append(struct.unpack(PEAK_FMT, data))
-            data = f.read(fmtsize)
-    return peaks
+        peaks = np.fromfile(f, dtype="<i4")
+    return peaks.astype(np.int32).reshape(-1, 2)
 
 
 # ####### function signature for Gordon feature extraction
@@ -575,7 +894,7 @@ def glob2hashtable(pattern, density=20.0):
 
     ht = hash_table.HashTable()
     filelist = glob.glob(pattern)
-    initticks = time.clock()
+    initticks = time.perf_counter()
     totdur = 0.0
     tothashes = 0
     for ix, file_ in enumerate(filelist):
@@ -583,7 +902,7 @@ def glob2hashtable(pattern, density=20.0):
         dur, nhash = g2h_analyzer.ingest(ht, file_)
         totdur += dur
         tothashes += nhash
-    elapsedtime = time.clock() - initticks
+    elapsedtime = time.perf_counter() - initticks
     print(
         "Added",
         tothashes,
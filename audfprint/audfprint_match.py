@@ -286,6 +286,24 @@ class Matcher(object):
         # Make sure every value in alltimes is >=0 for bincount
         mintime = np.amin(alltimes)
         alltimes -= mintime
+        # Histogram the time skews for all the candidate ids in a single
+        # flat bincount over (id_rank * timespan + time), rather than
+        # rescanning the whole hit list once per id.
+        idarray = np.asarray(ids, dtype=int)
+        if not len(idarray):
+            # There were hits, but no id survived the raw-count cut.
+            return results
+        id_to_rank = np.full(
+            max(int(np.amax(allids)), int(np.amax(idarray))) + 1, -1, dtype=int
+        )
+        id_to_rank[idarray] = np.arange(len(idarray))
+        hitranks = id_to_rank[allids]
+        inplay = hitranks >= 0
+        timespan = int(np.amax(alltimes)) + 1
+        allbincounts = np.bincount(
+            hitranks[inplay] * timespan + alltimes[inplay],
+            minlength=len(idarray) * timespan,
+        ).reshape(len(idarray), timespan)
         nresults = 0
         min_time = 0
         max_time = 0
@@ -293,7 +311,7 @@ class Matcher(object):
             # Make sure id is an int64 before shifting it up.
             id = int(id)
             # Select the subrange of bincounts corresponding to this id
-            bincounts = np.bincount(alltimes[allids == id])
+            bincounts = allbincounts[urank]
             still_looking = True
             # Only consider legit local maxima in bincounts.
             filtered_bincounts = keep_local_maxes(bincounts)
@@ -19,6 +19,7 @@
 # THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 from __future__ import division
 
+import io
 import os
 import re
 import subprocess
@@ -45,8 +46,10 @@ HAVE_FFMPEG = True
 
 def wavread(filename):
   """Read in audio data from a wav file.  Return d, sr."""
-  # Read in wav file.
-  samplerate, wave_data = wav.read(filename)
+  # Read in wav file through a large buffer, so the kernel sees a few
+  # 1 MB read()s rather than thousands of small ones.
+  with io.BufferedReader(io.FileIO(filename, 'rb'), buffer_size=1 << 20) as f:
+    samplerate, wave_data = wav.read(f)
   # Normalize short ints to floats in range [-1..1).
   data = np.asfarray(wave_data) / 32768.0
   return data, samplerate
@@ -67,6 +70,83 @@ def audio_read(filename, sr=None, channels=None):
         return data, samplerate
 
 
+def audio_read_blocks(filename, sr=None, channels=None,
+                      block_samps=1 << 20, overlap_samps=0):
+    """Read a soundfile as a sequence of overlapping blocks.
+
+    Yields (start_sample, block) pairs where each block is at most
+    block_samps samples long and consecutive blocks share their last/
+    first overlap_samps samples.  Memory use stays O(block_samps)
+    instead of O(file).  Only mono (channels == 1) streams are blocked;
+    anything else falls back to a single whole-file block.
+    """
+    if channels != 1:
+        d, _ = audio_read(filename, sr=sr, channels=channels)
+        yield 0, d
+    elif HAVE_FFMPEG:
+        for start, block in _audio_read_blocks_ffmpeg(
+            filename, sr, channels, block_samps, overlap_samps):
+            yield start, block
+    else:
+        for start, block in _audio_read_blocks_wav(
+            filename, sr, block_samps, overlap_samps):
+            yield start, block
+
+
+def _audio_read_blocks_ffmpeg(filename, sr, channels, block_samps,
+                              overlap_samps):
+    """Blocked read via the ffmpeg pipe; accumulates decoded frames and
+    yields them block_samps at a time."""
+    hop_samps = block_samps - overlap_samps
+    start = 0
+    buf = np.zeros(0, dtype=np.float32)
+    frames = [buf]
+    nbuffered = 0
+    with FFmpegAudioFile(os.path.realpath(filename),
+                         sample_rate=sr, channels=channels) as input_file:
+        for frame in input_file:
+            frame = buf_to_float(frame, dtype=np.float32)
+            frames.append(frame)
+            nbuffered += len(frame)
+            if nbuffered >= block_samps:
+                buf = np.concatenate(frames)
+                while len(buf) >= block_samps:
+                    yield start, buf[:block_samps]
+                    buf = buf[hop_samps:]
+                    start += hop_samps
+                frames = [buf]
+                nbuffered = len(buf)
+    buf = np.concatenate(frames)
+    # A final partial block, but only if it holds samples beyond the
+    # overlap already included in the previous block.
+    if len(buf) and (start == 0 or len(buf) > overlap_samps):
+        yield start, buf
+
+
+def _audio_read_blocks_wav(filename, sr, block_samps, overlap_samps):
+    """Blocked read of a plain wav file.  The file is memory-mapped so
+    only the pages for the current block are touched."""
+    hop_samps = block_samps - overlap_samps
+    with io.BufferedReader(io.FileIO(filename, 'rb'),
+                           buffer_size=1 << 20) as f:
+        samplerate, wave_data = wav.read(f, mmap=True)
+        if sr and sr != samplerate:
+            raise ValueError("Wav file has samplerate %f but %f requested." % (
+                samplerate, sr))
+        nsamps = wave_data.shape[0]
+        start = 0
+        while True:
+            end = min(start + block_samps, nsamps)
+            block = np.asarray(wave_data[start:end], dtype=float) / 32768.0
+            if block.ndim == 2 and block.shape[-1] != 1:
+                # Convert stereo to mono.
+                block = np.mean(block, axis=-1)
+            yield start, block
+            if end >= nsamps:
+                break
+            start += hop_samps
+
+
 def audio_read_ffmpeg(filename, sr=None, channels=None):
     """Read a soundfile, return (d, sr)."""
     # Hacked version of librosa.load and audioread/ff.
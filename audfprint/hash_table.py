@@ -13,6 +13,7 @@ import gzip
 import math
 import os
 import random
+import struct
 import sys
 
 import numpy as np
@@ -36,6 +37,11 @@ HT_COMPAT_VERSION = 20170724
 # Earliest version that can be updated with load_old
 HT_OLD_COMPAT_VERSION = 20140920
 
+# Magic prefix for the uncompressed on-disk format: a pickled metadata
+# header followed by the raw table bytes, so load can memory-map the
+# table instead of unpickling (and copying) the whole array.
+HT_FILE_MAGIC = b"audfprintdbasV00"  # 16 chars, like the .afpt magic
+
 
 def _bitsfor(maxval):
     """ Convert a maxval into a number of bits (left shift).
@@ -95,45 +101,42 @@ class HashTable(object):
         id_ = self.name_to_id(name, add_if_missing=True)
         # Now insert the hashes
         hashmask = (1 << self.hashbits) - 1
-        # mxtime = self.maxtime
         maxtime = 1 << self.maxtimebits
         timemask = maxtime - 1
-        # Try sorting the pairs by hash value, for better locality in storing
-        # sortedpairs = sorted(timehashpairs, key=lambda x:x[1])
-        sortedpairs = timehashpairs
-        # Tried making it an np array to permit vectorization, but slower...
-        # sortedpairs = np.array(sorted(timehashpairs, key=lambda x:x[1]),
-        #                       dtype=int)
-        # Keep only the bottom part of the time value
-        # sortedpairs[:,0] = sortedpairs[:,0] % self.maxtime
-        # Keep only the bottom part of the hash value
-        # sortedpairs[:,1] = sortedpairs[:,1] & hashmask
         # The id value is based on (id_ + 1) to avoid an all-zero value.
         idval = (id_ + 1) << self.maxtimebits
-        for time_, hash_ in sortedpairs:
-            # Keep only the bottom part of the hash value
-            hash_ &= hashmask
-            # How many already stored for this hash?
-            count = self.counts[hash_]
-            # Keep only the bottom part of the time value
-            # time_ %= mxtime
-            time_ &= timemask
-            # Mixin with ID
-            val = (idval + time_)  # .astype(np.uint32)
-            if count < self.depth:
-                # insert new val in next empty slot
-                # slot = self.counts[hash_]
-                self.table[hash_, count] = val
-            else:
-                # Choose a point at random
+        pairs = np.asarray(timehashpairs)
+        if len(pairs):
+            # Keep only the bottom part of the hash and time values, and
+            # mix the time in with the ID
+            hashes = pairs[:, 1] & hashmask
+            vals = idval + (pairs[:, 0] & timemask)
+            # Group the new entries by bucket; the stable sort keeps
+            # them in arrival order within each bucket, so appends land
+            # contiguously after the bucket's current entries.
+            order = np.argsort(hashes, kind='stable')
+            hashes = hashes[order]
+            vals = vals[order]
+            buckets, firsts = np.unique(hashes, return_index=True)
+            nnew = np.diff(np.r_[firsts, len(hashes)])
+            # The slot each entry would take if buckets were unbounded:
+            # bucket fill so far plus position within this batch
+            slots = (np.repeat(self.counts[buckets].astype(np.int64), nnew)
+                     + np.arange(len(hashes)) - np.repeat(firsts, nnew))
+            fits = slots < self.depth
+            # All entries that fit land in one scatter
+            self.table[hashes[fits], slots[fits]] = vals[fits]
+            # Entries past the end of their bucket get the original
+            # reservoir treatment: a random slot out of the count so
+            # far, stored only if it falls inside the table
+            for hash_, count, val in zip(hashes[~fits], slots[~fits], vals[~fits]):
                 slot = random.randint(0, count)
-                # Only store if random slot wasn't beyond end
                 if slot < self.depth:
                     self.table[hash_, slot] = val
-            # Update record of number of vals in this bucket
-            self.counts[hash_] = count + 1
+            # Update record of number of vals in each bucket
+            self.counts[buckets] = self.counts[buckets] + nnew
         # Record how many hashes we (attempted to) save for this id
-        self.hashesperid[id_] += len(timehashpairs)
+        self.hashesperid[id_] += len(pairs)
         # Mark as unsaved
         self.dirty = True
 
@@ -184,10 +187,34 @@ class HashTable(object):
             for key in params:
                 self.params[key] = params[key]
         if file_object:
-            f = file_object
+            # Caller controls the stream (and any compression): fall
+            # back to pickling the whole object as before.
+            pickle.dump(self, file_object, pickle.HIGHEST_PROTOCOL)
         else:
-            f = gzip.open(name, 'wb')
-        pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+            # Uncompressed format: magic, pickled metadata header, then
+            # the raw little-endian table bytes at a known offset so
+            # load() can np.memmap them.
+            header = pickle.dumps(
+                {'ht_version': self.ht_version,
+                 'hashbits': self.hashbits,
+                 'depth': self.depth,
+                 'maxtimebits': self.maxtimebits,
+                 'counts': self.counts,
+                 'names': self.names,
+                 'hashesperid': self.hashesperid,
+                 'params': self.params},
+                pickle.HIGHEST_PROTOCOL)
+            # Write to a temporary name then rename into place: if
+            # self.table is a memmap of <name> (from load_raw), opening
+            # <name> for writing would truncate the pages still being
+            # read out of it.
+            tmpname = name + '.tmp'
+            with open(tmpname, 'wb') as f:
+                f.write(HT_FILE_MAGIC)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                np.ascontiguousarray(self.table, dtype='<u4').tofile(f)
+            os.replace(tmpname, name)
         self.dirty = False
         nhashes = sum(self.counts)
         # Report the proportion of dropped hashes (overfull table)
@@ -197,12 +224,17 @@ class HashTable(object):
               "(%.2f%% dropped)" % (100.0 * dropped / max(1, nhashes)))
 
     def load(self, name):
-        """ Read either pklz or mat-format hash table file """
+        """ Read a raw, pklz or mat-format hash table file """
         ext = os.path.splitext(name)[1]
         if ext == '.mat':
             self.load_matlab(name)
         else:
-            self.load_pkl(name)
+            with open(name, 'rb') as f:
+                magic = f.read(len(HT_FILE_MAGIC))
+            if magic == HT_FILE_MAGIC:
+                self.load_raw(name)
+            else:
+                self.load_pkl(name)
         nhashes = sum(self.counts)
         # Report the proportion of dropped hashes (overfull table)
         dropped = nhashes - sum(np.minimum(self.depth, self.counts))
@@ -245,6 +277,37 @@ class HashTable(object):
         self.dirty = False
         self.params = params
 
+    def load_raw(self, name):
+        """ Read hash table from the uncompressed raw format written by
+            save().  The big table is memory-mapped copy-on-write, so
+            the load itself is O(1) and pages are only pulled in (and
+            only copied if written) as buckets are touched. """
+        with open(name, 'rb') as f:
+            magic = f.read(len(HT_FILE_MAGIC))
+            if magic != HT_FILE_MAGIC:
+                raise IOError("%s is not a hash table file (magic %s)"
+                              % (name, magic))
+            (headerlen,) = struct.unpack('<Q', f.read(8))
+            header = pickle.loads(f.read(headerlen))
+            tableoffset = f.tell()
+        if header['ht_version'] < HT_COMPAT_VERSION:
+            raise ValueError('Version of ' + name + ' is '
+                             + str(header['ht_version'])
+                             + ' which is not at least '
+                             + str(HT_COMPAT_VERSION))
+        self.ht_version = header['ht_version']
+        self.hashbits = header['hashbits']
+        self.depth = header['depth']
+        self.maxtimebits = header['maxtimebits']
+        self.counts = header['counts']
+        self.names = header['names']
+        self.hashesperid = np.array(header['hashesperid']).astype(np.uint32)
+        self.params = header['params']
+        self.table = np.memmap(name, dtype='<u4', mode='c',
+                               offset=tableoffset,
+                               shape=(1 << self.hashbits, self.depth))
+        self.dirty = False
+
     def load_matlab(self, name):
         """ Read hash table from version saved by Matlab audfprint.
         :params:
@@ -322,6 +385,72 @@ class HashTable(object):
 
         self.dirty = True
 
+    def bulk_merge(self, tables):
+        """ Merge in the results from several other hash tables at once.
+            Equivalent to calling merge() for each in turn, but the
+            per-bucket Python loop is replaced by bulk NumPy gather/
+            scatter across all the incoming tables; only the (rare)
+            buckets that overflow depth fall back to per-bucket
+            random subselection.
+        """
+        if not len(tables):
+            return
+        new_hashes = []
+        new_vals = []
+        # Total hashes each table *attempted* to store per bucket, to
+        # keep the counts of overfull buckets accurate.
+        attempted = np.zeros(len(self.counts), dtype=np.int64)
+        ncurrent = len(self.names)
+        for ht in tables:
+            # Check compatibility
+            assert self.maxtimebits == ht.maxtimebits
+            # Shift all the IDs in this table down by ncurrent
+            idoffset = (1 << self.maxtimebits) * ncurrent
+            # Number of entries actually stored in each bucket
+            nper = np.minimum(ht.counts, ht.depth).astype(np.int64)
+            nz = np.nonzero(nper)[0]
+            nper_nz = nper[nz]
+            # (bucket, slot) index pairs for every stored entry
+            hrep = np.repeat(nz, nper_nz)
+            slot = np.arange(len(hrep)) - np.repeat(
+                np.cumsum(nper_nz) - nper_nz, nper_nz)
+            new_hashes.append(hrep)
+            new_vals.append(ht.table[hrep, slot].astype(np.int64) + idoffset)
+            attempted += ht.counts
+            self.names += ht.names
+            self.hashesperid = np.append(self.hashesperid, ht.hashesperid)
+            ncurrent += len(ht.names)
+        new_hashes = np.concatenate(new_hashes)
+        new_vals = np.concatenate(new_vals)
+        # Group the incoming entries by bucket (stable, so entries from
+        # successive tables stay in merge() order within a bucket)
+        order = np.argsort(new_hashes, kind='stable')
+        new_hashes = new_hashes[order]
+        new_vals = new_vals[order]
+        buckets, firsts = np.unique(new_hashes, return_index=True)
+        nnew = np.diff(np.r_[firsts, len(new_hashes)])
+        nexisting = np.minimum(self.counts[buckets], self.depth).astype(np.int64)
+        ntotal = nexisting + nnew
+        # Buckets that stay within depth: append after the existing
+        # entries with a single scatter, and track exact counts.
+        ok = ntotal <= self.depth
+        nok = nnew[ok]
+        okrows = np.repeat(buckets[ok], nok)
+        okcols = (np.repeat(nexisting[ok], nok)
+                  + np.arange(len(okrows))
+                  - np.repeat(np.cumsum(nok) - nok, nok))
+        self.table[okrows, okcols] = new_vals[np.repeat(ok, nnew)]
+        self.counts[buckets[ok]] = ntotal[ok]
+        # Overfull buckets: randomly subselect from old plus new, and
+        # keep counting the hashes we've seen for the bin.
+        for ix in np.nonzero(~ok)[0]:
+            hash_ = buckets[ix]
+            newvals = new_vals[firsts[ix]:firsts[ix] + nnew[ix]]
+            allvals = np.r_[self.table[hash_, :self.counts[hash_]], newvals]
+            self.table[hash_, ] = np.random.permutation(allvals)[:self.depth]
+            self.counts[hash_] += attempted[hash_]
+        self.dirty = True
+
     def name_to_id(self, name, add_if_missing=False):
         """ Lookup name in the names list, or optionally add. """
         if isinstance(name, basestring):
@@ -8,6 +8,17 @@ from __future__ import division
 
 import numpy as np
 
+try:
+  # Use FFTW if it is available: faster for these repeated
+  # medium-size transforms, and it releases the GIL while computing.
+  import pyfftw
+  pyfftw.interfaces.cache.enable()
+  rfft = pyfftw.interfaces.numpy_fft.rfft
+  HAVE_PYFFTW = True
+except ImportError:
+  rfft = np.fft.rfft
+  HAVE_PYFFTW = False
+
 
 def frame(data, window_length, hop_length):
   """Convert array into a sequence of successive possibly overlapping frames.
@@ -91,4 +102,4 @@ def stft(signal, n_fft, hop_length=None, window=None):
   # window_length) instead of the symmetric Hann of np.hanning (period
   # window_length-1).
   windowed_frames = frames * window
-  return np.fft.rfft(windowed_frames, n_fft).transpose()
+  return rfft(windowed_frames, n_fft).transpose()